@@ -6,22 +6,153 @@ Inspired by https://github.com/pallets-eco/flask-caching/blob/master/src/flask_c
 from __future__ import annotations
 import typing as t
 
+import atexit
+import io
 import datetime
+import functools
+import itertools
 import logging
-import io
+import operator
+import queue
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
 
 import boto3
-import botocore
+import botocore.config
+import botocore.exceptions
 from flask_caching.backends.base import BaseCache
 
+try:
+    from boto3.s3.transfer import TransferConfig, create_transfer_manager
+    from botocore.compat import HAS_CRT
+except ImportError:
+    HAS_CRT = False
+
+T = t.TypeVar("T")
+
 if t.TYPE_CHECKING:
     from flask import Flask
-    from mypy_boto3_s3 import S3ServiceResource
+    from mypy_boto3_s3 import S3Client, S3ServiceResource
     from mypy_boto3_s3.service_resource import Bucket as S3Bucket
+    from s3transfer.manager import TransferManager
 
 
 logger = logging.getLogger(__name__)
 
+#: Maximum number of keys S3 accepts in a single ``DeleteObjects`` request.
+DELETE_BATCH_SIZE = 1000
+
+#: Content types that items are stored with, which tell ``str`` values apart
+#: from ``bytes`` ones.
+TEXT_CONTENT_TYPE = "text/plain; charset=utf-8"
+BINARY_CONTENT_TYPE = "application/octet-stream"
+
+#: Domains of the S3 endpoints run by AWS itself.
+AWS_DOMAINS = (".amazonaws.com", ".amazonaws.com.cn")
+
+
+#: Seconds to wait at exit for background purges to finish.
+_PURGE_EXIT_TIMEOUT = 10.0
+
+#: Thread pools of live cache instances, shut down together at exit.
+_executors: weakref.WeakSet[ThreadPoolExecutor] = weakref.WeakSet()
+
+#: Transfer managers of live cache instances, which own thread pools too.
+_transfers: weakref.WeakSet[TransferManager] = weakref.WeakSet()
+
+#: Cache instances with a background purge thread, drained at exit.
+_purging: weakref.WeakSet[S3Cache] = weakref.WeakSet()
+
+
+@atexit.register
+def _shutdown() -> None:
+    """
+    Finish the background purges, and shut down the thread pools and transfer
+    managers, of all cache instances still alive at interpreter exit.
+
+    Pools are only tracked weakly, so those of discarded instances are
+    reclaimed, and their threads stopped, as soon as they're garbage.
+    """
+    for cache in list(_purging):
+        cache._stop_purging(_PURGE_EXIT_TIMEOUT)
+    for executor in list(_executors):
+        executor.shutdown()
+    for transfer in list(_transfers):
+        transfer.shutdown()
+
+
+def _batched(iterable: t.Iterable[T], size: int) -> t.Iterator[t.List[T]]:
+    """
+    Split ``iterable`` into lists of at most ``size`` items.
+    """
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+class _MetadataCache:
+    """
+    Thread-safe, size-bounded LRU of ``(exists, expires)`` pairs for cache
+    keys, where each entry is only trusted for a limited time.
+
+    :param maxsize: Maximum number of entries to retain.
+    :param ttl: Seconds that an entry for an existing object is trusted.
+    :param negative_ttl: Seconds that an entry for a missing object is trusted.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: OrderedDict[str, t.Tuple[float, bool, t.Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> t.Optional[t.Tuple[bool, t.Any]]:
+        """
+        Return the ``(exists, expires)`` pair for ``key``, if it is still fresh.
+        """
+        with self._lock:
+            try:
+                stale_at, exists, expires = self._entries[key]
+            except KeyError:
+                return None
+            if stale_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return exists, expires
+
+    def set(self, key: str, exists: bool, expires: t.Any = None):
+        """
+        Remember whether ``key`` exists, and when it expires.
+        """
+        ttl = self.ttl if exists else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, exists, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, *keys: str):
+        """
+        Forget anything known about ``keys``.
+        """
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Forget everything.
+        """
+        with self._lock:
+            self._entries.clear()
+
 
 class S3Cache(BaseCache):
     """
@@ -41,6 +172,62 @@ class S3Cache(BaseCache):
     :param default_timeout: the default timeout that is used if no timeout is
                             specified on :meth:`S3Cache.set`. A timeout of
                             ``0`` indicates that the cache never expires.
+    :param purge_expired_on_read: Delete expired items, or items with invalid
+                                  expiration metadata, from S3 when they are
+                                  encountered by :meth:`get` or :meth:`has`.
+    :param purge_in_background: Rather than deleting them as part of the
+                                :meth:`get` or :meth:`has` call, queue items
+                                that need purging for a background thread,
+                                which deletes them in bulk. Items still queued
+                                at interpreter exit are purged then, for up to
+                                10 seconds.
+    :param shard_bits: Spread keys over ``2 ** shard_bits`` S3 prefixes, by
+                       inserting a shard derived from a hash of the key
+                       between ``key_prefix`` and the key itself. S3 request
+                       rates are limited per prefix, so this raises the
+                       throughput ceiling of the cache. Changing this value
+                       effectively empties the cache.
+    :param metadata_cache_enabled: Remember, in-process, whether keys exist and
+                                   when they expire, so that repeated
+                                   :meth:`has`, :meth:`add` and :meth:`get`
+                                   calls can skip a round-trip to S3. Changes
+                                   made by other processes may go unnoticed
+                                   for up to ``metadata_cache_ttl`` seconds.
+    :param metadata_cache_ttl: Seconds to trust a cached entry for an item that
+                               exists.
+    :param metadata_cache_negative_ttl: Seconds to trust a cached entry for an
+                                        item that does not exist.
+    :param metadata_cache_max: Maximum number of keys to keep metadata for.
+    :param decode_responses: Return values that were stored as ``str`` from
+                             :meth:`get` as such, while those stored as
+                             ``bytes`` are always returned as ``bytes``. When
+                             ``False``, the raw bytes of every value are
+                             returned instead.
+    :param max_workers: Maximum number of threads used to issue concurrent
+                        requests for bulk operations, such as
+                        :meth:`get_many` and :meth:`set_many`. Each thread may
+                        hold open a connection to S3, so this trades a few file
+                        descriptors for near-linear speedups.
+    :param max_attempts: Maximum number of attempts for each S3 request,
+                         including the initial one.
+    :param retry_mode: botocore retry mode; one of ``"legacy"``,
+                       ``"standard"`` or ``"adaptive"``.
+    :param connect_timeout: Seconds to wait for a connection to S3.
+    :param read_timeout: Seconds to wait for S3 to respond.
+    :param tcp_keepalive: Enable TCP keep-alive on connections to S3.
+    :param parameter_validation: Validate request parameters against the S3
+                                 service model before sending them. This is
+                                 pure overhead for the requests issued here.
+    :param use_crt: Transfer large items in parts: upload them using the AWS
+                    Common Runtime (CRT), which splits them into concurrent
+                    multipart uploads, and read them as concurrent byte-range
+                    requests. Endpoints other than AWS's own use boto3's
+                    classic transfer manager for uploads instead. Requires the
+                    ``crt`` extra to be installed; otherwise this has no
+                    effect.
+    :param multipart_threshold: Size, in bytes, from which items are
+                                transferred in parts, and the size of those
+                                parts when reading.
     """
 
     class InvalidExpirationError(Exception):
@@ -50,24 +237,121 @@ class S3Cache(BaseCache):
 
         pass
 
+    #: boto3 S3 resources shared by all instances, keyed by endpoint URL and
+    #: client configuration.
+    _resource_cache: t.Dict[t.Tuple[t.Hashable, ...], S3ServiceResource] = {}
+    _resource_lock = threading.Lock()
+
+    #: Whether conditional writes (``If-None-Match``) are usable, by endpoint URL.
+    _conditional_writes: t.Dict[t.Optional[str], bool] = {}
+
     def __init__(
         self,
         bucket: str,
         key_prefix: t.Optional[str] = None,
         default_timeout: int = 300,
         purge_expired_on_read: bool = False,
+        purge_in_background: bool = False,
+        shard_bits: int = 0,
+        metadata_cache_enabled: bool = False,
+        metadata_cache_ttl: float = 5,
+        metadata_cache_negative_ttl: float = 1,
+        metadata_cache_max: int = 1024,
+        decode_responses: bool = True,
+        max_workers: int = 32,
+        max_attempts: int = 2,
+        retry_mode: str = "adaptive",
+        connect_timeout: float = 1.0,
+        read_timeout: float = 5.0,
+        tcp_keepalive: bool = True,
+        parameter_validation: bool = False,
+        use_crt: bool = True,
+        multipart_threshold: int = 8 * 1024 * 1024,
         **kwargs,
     ):
         super().__init__(default_timeout)
 
-        # Initialize the s3 resource with the required configuration parameters
-        self._client: S3ServiceResource = boto3.resource(
-            service_name="s3", endpoint_url=kwargs.get("CACHE_S3_ENDPOINT_URL")
+        # Reuse the s3 resource for the configured endpoint, if there is one
+        self._endpoint_url: t.Optional[str] = kwargs.get("CACHE_S3_ENDPOINT_URL")
+        self._client: S3ServiceResource = self._get_resource(
+            self._endpoint_url,
+            max_attempts=max_attempts,
+            retry_mode=retry_mode,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            tcp_keepalive=tcp_keepalive,
+            parameter_validation=parameter_validation,
+            # Leave room for every worker thread to hold a connection, so that
+            # the pool doesn't serialize concurrent requests.
+            max_pool_connections=max(max_workers * 2, 20),
         )
         self.bucket: S3Bucket = self._client.Bucket(bucket)
+
+        # The low-level client and its exception classes are used directly on
+        # the hot paths, to avoid building resource objects on every call.
+        self._s3_client: S3Client = self._client.meta.client
+        self._bucket_name = bucket
+        self._NoSuchKey = self._s3_client.exceptions.NoSuchKey
+        self._NoSuchBucket = self._s3_client.exceptions.NoSuchBucket
+        self._ClientError = self._s3_client.exceptions.ClientError
         self.key_prefix = key_prefix or ""
+
+        if not 0 <= shard_bits <= 32:
+            raise ValueError("shard_bits must be between 0 and 32.")
+        self.shard_bits = shard_bits
+        self._shard_mask = (1 << shard_bits) - 1
+        self._shard_format = f"0{-(-shard_bits // 4)}x"
         self.default_timeout = default_timeout
+
+        # Bind the cheapest way of building object names for this
+        # configuration, rather than deciding on every call.
+        self._full_key: t.Callable[[str], str]
+        if shard_bits:
+            self._full_key = self._sharded_key
+        elif self.key_prefix:
+            self._full_key = functools.partial(operator.add, self.key_prefix)
+        else:
+            self._full_key = lambda key: key
+
+        # Likewise, items that never expire by default need no metadata.
+        self._default_metadata: t.Optional[t.Dict[str, str]] = (
+            {} if default_timeout == 0 else None
+        )
         self.purge_expired_on_read = purge_expired_on_read
+        self.purge_in_background = purge_in_background
+        self.decode_responses = decode_responses
+
+        self._metadata_cache: t.Optional[_MetadataCache] = None
+        if metadata_cache_enabled:
+            self._metadata_cache = _MetadataCache(
+                metadata_cache_max, metadata_cache_ttl, metadata_cache_negative_ttl
+            )
+
+        # Thread pools for fanning out bulk requests, and the parts of large
+        # items; created on first use.
+        self._max_workers = max_workers
+        self._executor: t.Optional[ThreadPoolExecutor] = None
+        self._part_executor: t.Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+        # CRT transfer manager for uploading large items; created on first use.
+        self._use_crt = use_crt and HAS_CRT
+        self._multipart_threshold = multipart_threshold
+        self._transfer: t.Optional[TransferManager] = None
+        self._transfer_lock = threading.Lock()
+
+        # When large items are transferred in parts, reads only fetch the first
+        # part at first; that's enough to check expirations, and is the whole
+        # item more often than not.
+        self._get_kwargs: t.Dict[str, str] = (
+            {"Range": f"bytes=0-{multipart_threshold - 1}"} if self._use_crt else {}
+        )
+
+        # Keys waiting to be purged by the background thread, if enabled.
+        # ``None`` tells the thread to stop.
+        self._purge_queue: queue.SimpleQueue[t.Optional[str]] = queue.SimpleQueue()
+        self._purge_thread: t.Optional[threading.Thread] = None
+        self._purge_thread_lock = threading.Lock()
 
     @classmethod
     def factory(
@@ -90,31 +374,161 @@ class S3Cache(BaseCache):
             kwargs["default_timeout"] = default_timeout
         return cls(*args, **kwargs)
 
-    def _utcnow(self) -> datetime.datetime:
+    @classmethod
+    def _get_resource(
+        cls,
+        endpoint_url: t.Optional[str],
+        max_attempts: int,
+        retry_mode: str,
+        **config_options: t.Hashable,
+    ) -> S3ServiceResource:
         """
-        Return a datetime representing the current time for UTC
+        Return the S3 resource for ``endpoint_url`` and the given client
+        configuration, creating it on first use.
+
+        Creating a resource loads the service models and sets up a new session,
+        which is far too slow to repeat for every cache instance.
         """
-        return datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
+        cache_key = (
+            endpoint_url,
+            max_attempts,
+            retry_mode,
+            *sorted(config_options.items()),
+        )
+        try:
+            return cls._resource_cache[cache_key]
+        except KeyError:
+            pass
 
-    def _normalize_expires(
-        self, expires_at: t.Optional[str]
-    ) -> t.Optional[datetime.datetime]:
+        with cls._resource_lock:
+            if cache_key not in cls._resource_cache:
+                config = botocore.config.Config(
+                    retries={"total_max_attempts": max_attempts, "mode": retry_mode},
+                    **config_options,
+                )
+                cls._resource_cache[cache_key] = boto3.resource(
+                    service_name="s3", endpoint_url=endpoint_url, config=config
+                )
+            return cls._resource_cache[cache_key]
+
+    def _sharded_key(self, key: str) -> str:
         """
-        Convert metadata expiration to usable datetime object
+        Return the S3 object name for ``key``, including prefix and shard.
+
+        :param key: The unique identifier for the relevant item.
+        """
+        # A stable hash is required here, since the built-in ``hash()`` is
+        # randomized per process.
+        shard = format(zlib.crc32(key.encode()) & self._shard_mask, self._shard_format)
+        return f"{self.key_prefix}{shard}/{key}"
+
+    def _supports_conditional_writes(self) -> bool:
+        """
+        Whether ``PutObject`` can be made conditional on the key not existing,
+        or on the ETag of the item it replaces.
+
+        This requires a botocore version that knows about ``IfNoneMatch`` and
+        ``IfMatch``, and an endpoint that implements them; the latter is only
+        discovered the first time that a conditional write is rejected.
         """
-        if expires_at is None:
-            return None
         try:
-            converted = datetime.datetime.fromtimestamp(
-                int(expires_at), tz=datetime.timezone.utc
+            return self._conditional_writes[self._endpoint_url]
+        except KeyError:
+            pass
+
+        put_object = self._s3_client.meta.service_model.operation_model("PutObject")
+        members = put_object.input_shape.members
+        supported = "IfNoneMatch" in members and "IfMatch" in members
+        self._conditional_writes[self._endpoint_url] = supported
+        return supported
+
+    def _build_put_kwargs(
+        self, value: t.Any, timeout: t.Optional[int] = None
+    ) -> t.Dict[str, t.Any]:
+        """
+        Build the body, content type and expiration headers for a ``PutObject``
+        request.
+
+        The content type records whether ``value`` is ``str`` or ``bytes``, so
+        that :meth:`get` can return the same type.
+
+        The expiration is sent as the standard ``Expires`` header, and also as
+        ``expires_at`` user-metadata so that processes still running earlier
+        versions of this package honor it. The latter will be dropped in a
+        future release.
+
+        :param value: The data to be cached; either ``str`` or ``bytes``.
+        :param timeout: When the data should expire, in seconds.
+        """
+        put_kwargs: t.Dict[str, t.Any]
+        if isinstance(value, str):
+            put_kwargs = {
+                "Body": value.encode("utf-8"),
+                "ContentType": TEXT_CONTENT_TYPE,
+            }
+        elif isinstance(value, (bytes, bytearray)):
+            # botocore accepts bytes-like bodies as they are
+            put_kwargs = {"Body": value, "ContentType": BINARY_CONTENT_TYPE}
+        else:
+            # Anything else would come back as a different type, or not at
+            # all, so refuse it rather than poison the cache.
+            raise TypeError(
+                "S3Cache can only store str or bytes values, "
+                f"not {type(value).__name__}"
             )
-        except (OverflowError, TypeError):
-            logger.error("invalid expiration of %r" % expires_at)
-            raise self.InvalidExpirationError()
 
-        return converted
+        if timeout is None and self._default_metadata is not None:
+            put_kwargs["Metadata"] = self._default_metadata
+            return put_kwargs
+
+        timeout = self._normalize_timeout(timeout)
+        if timeout <= 0:
+            put_kwargs["Metadata"] = {}
+            return put_kwargs
+
+        expires_ts = int(self._now_ts() + timeout)
+        put_kwargs["Expires"] = datetime.datetime.fromtimestamp(
+            expires_ts, tz=datetime.timezone.utc
+        )
+        put_kwargs["Metadata"] = {"expires_at": f"{expires_ts:010d}"}
+        return put_kwargs
+
+    def _now_ts(self) -> float:
+        """
+        Return the current time, in seconds since the epoch
+        """
+        return time.time()
+
+    def _get_expires(self, result: t.Mapping[str, t.Any]) -> t.Optional[int]:
+        """
+        Return the expiration of an item, in seconds since the epoch, from a
+        ``GetObject`` or ``HeadObject`` response.
+
+        botocore already parses the ``Expires`` header; items written by
+        earlier versions of this package only carry ``expires_at`` metadata.
+        """
+        if (expires := result.get("Expires")) is not None:
+            return int(expires.timestamp())
+        return self._normalize_expires(result["Metadata"].get("expires_at"))
+
+    def _normalize_expires(self, expires_at: t.Optional[str]) -> t.Optional[int]:
+        """
+        Convert metadata expiration to seconds since the epoch
+        """
+        if not expires_at:
+            return None
+
+        # Valid expirations are always ASCII digits, which ``int()`` is sure to
+        # accept, so anything else can be rejected up front. They are written
+        # zero-padded to a fixed width, but items written by earlier versions
+        # of this package may be shorter.
+        if expires_at.isascii() and expires_at.isdigit():
+            return int(expires_at)
+
+        logger.error("invalid expiration of %r", expires_at)
+        raise self.InvalidExpirationError()
 
-    def get(self, key) -> t.Optional[str]:
+    def get(self, key) -> t.Optional[t.Union[str, bytes]]:
         """
         Get the cache value identified by ``key``.
 
@@ -125,99 +539,331 @@ class S3Cache(BaseCache):
 
         :param key: The unique identifier for the relevant item.
         """
-        full_key = self.key_prefix + key
-        object = self.bucket.Object(full_key)
+        full_key = self._full_key(key)
+
+        if self._cached_has(full_key) is False:
+            logger.debug("get key %r -> miss (cached metadata)", full_key)
+            return None
 
         try:
-            result = object.get()
-        except self._client.meta.client.exceptions.NoSuchKey:
+            result = self._get_object(full_key)
+        except self._NoSuchKey:
             # Does not exist
             logger.debug("get key %r -> miss", full_key)
+            if self._metadata_cache is not None:
+                self._metadata_cache.set(full_key, False)
             return None
-        except self._client.meta.client.exceptions.NoSuchBucket:
+        except self._NoSuchBucket:
             # Unauthorized/invalid bucket
             logger.error("get key %r -> unauthorized", full_key)
             return None
-        except self._client.meta.client.exceptions.ClientError:
-            # In case of an error we can't handle, log it, and fail
-            # gracefully. A cache miss is better than a poisoned cache.
+        except (self._ClientError, botocore.exceptions.BotoCoreError):
+            # In case of an error we can't handle, including timeouts and
+            # other connection errors, log it, and fail gracefully. A cache
+            # miss is better than a poisoned cache.
             logger.exception("get key %r -> error", full_key)
             return None
 
         try:
-            expires = self._normalize_expires(result["Metadata"].get("expires_at"))
+            expires = self._get_expires(result)
         except self.InvalidExpirationError:
             logger.error(
-                "get key %r -> invalid expiration metadata %r, purging"
-                % (full_key, result["Metadata"])
+                "get key %r -> invalid expiration metadata %r",
+                full_key,
+                result["Metadata"],
             )
-            object.delete()
-            logger.debug("get key %r -> purged", full_key)
+            if self.purge_expired_on_read:
+                self._purge(full_key)
+                logger.debug("get key %r -> purged", full_key)
             return None
 
-        if expires is not None and expires < self._utcnow():
+        if self._metadata_cache is not None:
+            self._metadata_cache.set(full_key, True, expires)
+
+        if expires is not None and expires < self._now_ts():
             logger.debug("get key %r -> expired", full_key)
             if self.purge_expired_on_read:
-                object.delete()
+                self._purge(full_key)
                 logger.debug("get key %r -> purged", full_key)
             return None
 
-        return result["Body"].read().decode()
+        # Reading the body, even if it's only the first part of the item,
+        # returns the connection to the pool.
+        try:
+            body = result["Body"].read()
+        except botocore.exceptions.BotoCoreError:
+            logger.exception("get key %r -> error", full_key)
+            return None
+
+        if self._get_kwargs and (size := self._item_size(result)) > len(body):
+            try:
+                parts = self._get_parts(full_key, result["ETag"], len(body), size)
+            except self._ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "PreconditionFailed":
+                    logger.exception("get key %r -> error", full_key)
+                else:
+                    logger.debug("get key %r -> miss (replaced)", full_key)
+                return None
+            except botocore.exceptions.BotoCoreError:
+                logger.exception("get key %r -> error", full_key)
+                return None
+            body = b"".join([body, *parts])
+
+        # Items written by earlier versions of this package have no content
+        # type of their own, and were always strings.
+        if (
+            not self.decode_responses
+            or result.get("ContentType") == BINARY_CONTENT_TYPE
+        ):
+            return body
+        try:
+            return body.decode()
+        except UnicodeDecodeError:
+            logger.error("get key %r -> invalid UTF-8", full_key)
+            return None
+
+    def _get_object(self, key: str) -> t.Dict[str, t.Any]:
+        """
+        Issue a ``GetObject`` request for ``key``, limited to the first
+        ``multipart_threshold`` bytes when large items are fetched by the CRT.
+
+        :param key: The unique identifier for the relevant item.
+        """
+        try:
+            return self._s3_client.get_object(
+                Bucket=self._bucket_name, Key=key, **self._get_kwargs
+            )
+        except self._ClientError as e:
+            # Empty items have no byte range to speak of
+            code = e.response.get("Error", {}).get("Code")
+            if not self._get_kwargs or code != "InvalidRange":
+                raise
+        return self._s3_client.get_object(Bucket=self._bucket_name, Key=key)
+
+    def _get_parts(self, key: str, etag: str, offset: int, size: int) -> t.List[bytes]:
+        """
+        Fetch the rest of a large item, from ``offset`` up to ``size`` bytes,
+        as concurrent byte-range requests of ``multipart_threshold`` bytes.
+
+        Every request is conditional on the item's ETag still being ``etag``,
+        so that S3 rejects it if the item whose expiration was checked has been
+        replaced since.
+
+        :param key: The unique identifier for the relevant item.
+        :param etag: The ETag of the item, from its first part.
+        :param offset: Number of bytes already fetched.
+        :param size: Full size of the item, in bytes.
+        """
+
+        def get_part(start: int) -> bytes:
+            end = min(start + self._multipart_threshold, size) - 1
+            result = self._s3_client.get_object(
+                Bucket=self._bucket_name,
+                Key=key,
+                Range=f"bytes={start}-{end}",
+                IfMatch=etag,
+            )
+            return result["Body"].read()
+
+        starts = range(offset, size, self._multipart_threshold)
+        return list(self._get_part_executor().map(get_part, starts))
+
+    @staticmethod
+    def _item_size(result: t.Mapping[str, t.Any]) -> int:
+        """
+        Return the full size of an item from a ``GetObject`` response, which
+        may only be for part of it.
+        """
+        if content_range := result.get("ContentRange"):
+            # e.g. "bytes 0-8388607/12345678"
+            return int(content_range.rpartition("/")[2])
+        return result["ContentLength"]
 
     def set(self, key: str, value: t.Any, timeout: t.Optional[int] = None) -> bool:
         """
         Put ``value`` into into the cache, identified by ``key``, for ``timeout`` seconds.
 
+        Only ``str`` and ``bytes`` values can be stored; anything else raises
+        :class:`TypeError`.
+
         :param key: The unique identifier for the relevant item.
         :param value: The data to be cached.
         :param timeout: When the data should expire, in seconds.
         """
-        full_key = self.key_prefix + key
-        object = self.bucket.Object(full_key)
-        timeout = self._normalize_timeout(timeout)
+        full_key = self._full_key(key)
+        put_kwargs = self._build_put_kwargs(value, timeout)
 
-        expires = (
-            (self._utcnow() + datetime.timedelta(seconds=timeout))
-            if timeout > 0
-            else None
-        )
-        metadata = {"expires_at": str(int(expires.timestamp()))} if expires else {}
-
-        result = object.put(
-            Body=io.BytesIO(bytes(value, "utf-8")),
-            Metadata=metadata,
-        )
+        if self._use_crt and len(put_kwargs["Body"]) >= self._multipart_threshold:
+            result = (
+                self._get_transfer()
+                .upload(
+                    io.BytesIO(put_kwargs["Body"]),
+                    self._bucket_name,
+                    full_key,
+                    extra_args={
+                        name: arg for name, arg in put_kwargs.items() if name != "Body"
+                    },
+                )
+                .result()
+            )
+        else:
+            result = self._s3_client.put_object(
+                Bucket=self._bucket_name, Key=full_key, **put_kwargs
+            )
+        if self._metadata_cache is not None:
+            self._metadata_cache.discard(full_key)
 
         logger.debug("set key %r -> %s", full_key, result)
         return True
 
+    def get_many(self, *keys: str) -> t.List[t.Optional[t.Union[str, bytes]]]:
+        """
+        Get the cache values identified by ``keys``, in the same order.
+
+        The individual requests are issued concurrently.
+
+        :param keys: Variable length argument list of key names to get.
+        """
+        if len(keys) <= 1:
+            return [self.get(key) for key in keys]
+        return list(self._get_executor().map(self.get, keys))
+
+    def set_many(
+        self, mapping: t.Mapping[str, t.Any], timeout: t.Optional[int] = None
+    ) -> t.List[str]:
+        """
+        Put every value of ``mapping`` into the cache, identified by its key, for
+        ``timeout`` seconds.
+
+        The individual requests are issued concurrently. Returns the keys that
+        were successfully set.
+
+        :param mapping: The keys and data to be cached.
+        :param timeout: When the data should expire, in seconds.
+        """
+        keys = list(mapping)
+        results = self._get_executor().map(
+            lambda key: self.set(key, mapping[key], timeout), keys
+        )
+        return [key for key, result in zip(keys, results) if result]
+
     def add(self, key: str, value: t.Any, timeout: t.Optional[int] = None) -> bool:
         """
         Works identically to :meth:`set`, except this does not overwrite the
         value of already existing keys.
 
-        NOTE: This is not immune to race conditions due to how the S3 API/service
-              is implemented. It's possible that the interval between the existence
-              check and the underlying :meth:`set` operation
+        Where the S3 endpoint supports conditional writes, this is free of race
+        conditions: the item is only written if the key is missing, and an
+        expired item is only replaced if no other client has replaced it first.
+        Otherwise, it falls back to an existence check followed by :meth:`set`,
+        and another client may write the key in the interval between the two
+        operations.
 
         :param key: The unique identifier for the relevant item.
         :param value: The data to be cached.
         :param timeout: When the data should expire, in seconds.
         """
-        full_key = self.key_prefix + key
-        if self._has(full_key):
+        full_key = self._full_key(key)
+        if self._cached_has(full_key):
+            logger.debug("add key %r -> not added (cached metadata)", full_key)
+            return False
+
+        if self._supports_conditional_writes():
+            try:
+                added = self._put_if(
+                    full_key, value, timeout, IfNoneMatch="*"
+                ) or self._replace_expired(full_key, value, timeout)
+            except self._ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "NotImplemented":
+                    raise
+                logger.warning(
+                    "conditional writes unsupported by %s, falling back",
+                    self._endpoint_url or "S3",
+                )
+                self._conditional_writes[self._endpoint_url] = False
+            else:
+                if not added:
+                    logger.debug("add key %r -> not added", full_key)
+                return added
+
+        # A cached miss is not trusted with overwriting an existing item
+        if self._head(full_key):
             logger.debug("add key %r -> not added", full_key)
             return False
         else:
             return self.set(key, value, timeout)
 
+    def _put_if(
+        self, key: str, value: t.Any, timeout: t.Optional[int], **condition: str
+    ) -> bool:
+        """
+        Put ``value`` into the cache as ``key``, on an ``IfNoneMatch`` or
+        ``IfMatch`` condition.
+
+        Returns ``False`` if S3 rejected the write because the condition failed,
+        or because another write to the key was in progress.
+
+        :param key: The unique identifier for the relevant item.
+        :param value: The data to be cached.
+        :param timeout: When the data should expire, in seconds.
+        """
+        try:
+            result = self._s3_client.put_object(
+                Bucket=self._bucket_name,
+                Key=key,
+                **condition,
+                **self._build_put_kwargs(value, timeout),
+            )
+        except self._ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise
+            return False
+        finally:
+            # Whatever happened, S3 knows better than any cached metadata
+            if self._metadata_cache is not None:
+                self._metadata_cache.discard(key)
+
+        logger.debug("put key %r if %s -> %s", key, condition, result)
+        return True
+
+    def _replace_expired(
+        self, key: str, value: t.Any, timeout: t.Optional[int]
+    ) -> bool:
+        """
+        Put ``value`` into the cache as ``key`` in place of an expired item, on
+        condition that no other client replaces or removes that item first.
+
+        Returns ``False`` if the existing item hasn't expired, or the condition
+        failed.
+
+        :param key: The unique identifier for the relevant item.
+        :param value: The data to be cached.
+        :param timeout: When the data should expire, in seconds.
+        """
+        result = self._head_object(key)
+        if result is None:
+            # Already gone, so this can only be added like any other item
+            return self._put_if(key, value, timeout, IfNoneMatch="*")
+
+        try:
+            expires = self._get_expires(result)
+        except self.InvalidExpirationError:
+            # Invalid expirations are no better than expired ones
+            pass
+        else:
+            if expires is None or expires >= self._now_ts():
+                return False
+
+        return self._put_if(key, value, timeout, IfMatch=result["ETag"])
+
     def delete(self, key: str) -> bool:
         """
         Delete a single item identified by ``key``.
 
         :param key: The unique identifier of the item to remove.
         """
-        full_key = self.key_prefix + key
+        full_key = self._full_key(key)
         return self._delete(full_key)
 
     def delete_many(self, *keys: str) -> bool:
@@ -226,7 +872,8 @@ class S3Cache(BaseCache):
 
         :param keys: Variable length argument list of key names to delete.
         """
-        return self._delete_many([self.key_prefix + key for key in keys])
+        # Sorting groups keys from the same shard into the same batches
+        return self._delete_many(sorted(self._full_key(key) for key in keys))
 
     def has(self, key: str) -> bool:
         """
@@ -234,7 +881,7 @@ class S3Cache(BaseCache):
 
         :param key: The unique identifier for the relevant item.
         """
-        full_key = self.key_prefix + key
+        full_key = self._full_key(key)
         return self._has(full_key)
 
     def clear(self) -> bool:
@@ -243,16 +890,31 @@ class S3Cache(BaseCache):
 
         Returns boolean on success/failure of clear operation.
         """
+        if self._metadata_cache is not None:
+            self._metadata_cache.clear()
+
+        paginator = self._s3_client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self._bucket_name,
+            Prefix=self.key_prefix,
+            PaginationConfig={"PageSize": DELETE_BATCH_SIZE},
+        )
+        # Each page is deleted while the next one is being listed
+        batches = (
+            [content["Key"] for content in page.get("Contents", [])] for page in pages
+        )
+
         try:
-            self.bucket.objects.filter(Prefix=f"{self.key_prefix}").delete()
-        except self._client.meta.client.exceptions.ClientError:
+            errors = self._delete_batches(batches)
+        except self._ClientError:
             logger.exception(
-                "Could not clear %s cache with prefix %s."
-                % (self.bucket.name, self.key_prefix)
+                "Could not clear %s cache with prefix %s.",
+                self._bucket_name,
+                self.key_prefix,
             )
             return False
 
-        return True
+        return self._log_delete_errors(errors)
 
     def _delete(self, key: str) -> bool:
         """
@@ -277,24 +939,140 @@ class S3Cache(BaseCache):
             logger.debug("delete many -> no keys provided, no-op")
             return True
 
-        keys = [{"Key": k} for k in keys]
-        result = self._client.meta.client.delete_objects(
-            Bucket=self.bucket.name, Delete={"Objects": keys}
+        if self._metadata_cache is not None:
+            self._metadata_cache.discard(*keys)
+
+        if len(keys) <= DELETE_BATCH_SIZE:
+            # Not worth a trip through the thread pool
+            errors = self._delete_batch(keys)
+        else:
+            errors = self._delete_batches(_batched(keys, DELETE_BATCH_SIZE))
+
+        return self._log_delete_errors(errors)
+
+    def _delete_batch(self, keys: t.Sequence[str]) -> t.List[t.Mapping]:
+        """
+        Delete up to :data:`DELETE_BATCH_SIZE` keys in a single request.
+
+        Returns the errors reported by S3, if any.
+
+        :param keys: Sequence of keys to be removed.
+        """
+        result = self._s3_client.delete_objects(
+            Bucket=self._bucket_name,
+            Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True},
         )
+        return result.get("Errors", [])
+
+    def _delete_batches(
+        self, batches: t.Iterable[t.Sequence[str]]
+    ) -> t.List[t.Mapping]:
+        """
+        Delete several batches of keys concurrently.
+
+        ``batches`` is consumed lazily, and no more than ``max_workers``
+        deletions are in flight at once, so that a slow producer (such as a
+        bucket listing) overlaps with the deletions without running arbitrarily
+        far ahead of them.
+
+        Returns the errors reported by S3 across all batches.
+
+        :param batches: Iterable of key sequences, each no larger than
+                        :data:`DELETE_BATCH_SIZE`.
+        """
+        executor = self._get_executor()
+        pending: t.Deque[Future[t.List[t.Mapping]]] = deque()
+        errors: t.List[t.Mapping] = []
+
+        for batch in batches:
+            if not batch:
+                continue
+            if len(pending) >= self._max_workers:
+                errors.extend(pending.popleft().result())
+            pending.append(executor.submit(self._delete_batch, batch))
 
-        errors = [msg for msg in result.get("Errors", [])]
+        for future in pending:
+            errors.extend(future.result())
+        return errors
 
+    def _get_transfer(self) -> TransferManager:
+        """
+        Return the CRT transfer manager used for uploading large items,
+        creating it on first use.
+        """
+        if self._transfer is None:
+            with self._transfer_lock:
+                if self._transfer is None:
+                    # boto3 sends CRT transfers to AWS itself, whatever the
+                    # client's endpoint, so other endpoints get the classic
+                    # transfer manager instead.
+                    host = urlsplit(self._s3_client.meta.endpoint_url).hostname
+                    self._transfer = create_transfer_manager(
+                        self._s3_client,
+                        TransferConfig(
+                            multipart_threshold=self._multipart_threshold,
+                            max_concurrency=10,
+                            preferred_transfer_client=(
+                                "crt"
+                                if (host or "").endswith(AWS_DOMAINS)
+                                else "classic"
+                            ),
+                        ),
+                    )
+                    _transfers.add(self._transfer)
+        return self._transfer
+
+    def _log_delete_errors(self, errors: t.Sequence[t.Mapping]) -> bool:
+        """
+        Log any errors from a deletion operation.
+
+        Returns ``True`` if there were no errors.
+        """
         # if we have any errors, return false for the whole operation
         if errors:
             for error in errors:
                 logger.error(
-                    "Could not delete key %s due to error %s: %s"
-                    % (error["Key"], error["Code"], error["Message"])
+                    "Could not delete key %s due to error %s: %s",
+                    error["Key"],
+                    error["Code"],
+                    error["Message"],
                 )
             return False
 
         return True
 
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """
+        Return the thread pool used for bulk operations, creating it on first use.
+
+        A single pool is shared by every concurrent operation of this instance.
+        """
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._max_workers, thread_name_prefix="s3cache"
+                    )
+                    _executors.add(self._executor)
+        return self._executor
+
+    def _get_part_executor(self) -> ThreadPoolExecutor:
+        """
+        Return the thread pool used for reading the parts of large items,
+        creating it on first use.
+
+        This is kept apart from the pool for bulk operations, whose threads may
+        be the ones waiting for the parts.
+        """
+        if self._part_executor is None:
+            with self._executor_lock:
+                if self._part_executor is None:
+                    self._part_executor = ThreadPoolExecutor(
+                        max_workers=10, thread_name_prefix="s3cache-part"
+                    )
+                    _executors.add(self._part_executor)
+        return self._part_executor
+
     def _has(self, key: str) -> bool:
         """
         Existence check for ``key`` in the S3 bucket.
@@ -303,43 +1081,197 @@ class S3Cache(BaseCache):
 
         :param key: The unique identifier for the relevant item.
         """
-        object = self.bucket.Object(key)
+        if (cached := self._cached_has(key)) is not None:
+            logger.debug("has key %r -> %s (cached metadata)", key, cached)
+            return cached
+        return self._head(key)
 
-        # Only fetches metadata; does not fetch actual object ``Body``.
-        try:
-            object.load()
-        except self._client.meta.client.exceptions.NoSuchKey:
-            # Does not exist
-            logger.debug("has key %r -> miss", key)
-            return False
-        except self._client.meta.client.exceptions.NoSuchBucket:
-            # Unauthorized/invalid bucket
-            logger.error("has key %r -> unauthorized", key)
-            return False
-        except self._client.meta.client.exceptions.ClientError:
-            # In case of an error we can't handle, log it, and fail
-            # gracefully. A cache miss is better than a poisoned cache.
-            logger.exception("has key %r -> error", key)
+    def _head(self, key: str) -> bool:
+        """
+        Existence check for ``key`` in the S3 bucket, bypassing the in-process
+        metadata cache.
+
+        If the key represents an _expired_ item, this will return ``False``.
+
+        :param key: The unique identifier for the relevant item.
+        """
+        result = self._head_object(key)
+        if result is None:
             return False
 
         try:
-            expires = self._normalize_expires(object.metadata.get("expires_at"))
+            expires = self._get_expires(result)
         except self.InvalidExpirationError:
             logger.error(
-                "has key %r -> invalid expiration metadata %r, purging"
-                % (key, object.metadata)
+                "has key %r -> invalid expiration metadata %r",
+                key,
+                result["Metadata"],
             )
-            object.delete()
-            logger.debug("get key %r -> purged", key)
+            if self.purge_expired_on_read:
+                self._purge(key)
+                logger.debug("has key %r -> purged", key)
             return False
 
-        if expires is not None and expires < self._utcnow():
+        if self._metadata_cache is not None:
+            self._metadata_cache.set(key, True, expires)
+
+        if expires is not None and expires < self._now_ts():
             logger.debug("has key %r -> expired", key)
             if self.purge_expired_on_read:
-                object.delete()
+                self._purge(key)
                 logger.debug("has key %r -> purged", key)
 
             return False
 
         logger.debug("has key %r", key)
         return True
+
+    def _head_object(self, key: str) -> t.Optional[t.Dict[str, t.Any]]:
+        """
+        Issue a ``HeadObject`` request for ``key``, whether or not the item has
+        expired.
+
+        Returns ``None`` if the item is missing, or can't be checked.
+
+        :param key: The unique identifier for the relevant item.
+        """
+        # Only fetches metadata; does not fetch actual object ``Body``.
+        try:
+            result = self._s3_client.head_object(Bucket=self._bucket_name, Key=key)
+        except self._ClientError as e:
+            # ``HeadObject`` responses have no body, so a missing key or bucket
+            # only surfaces as a bare HTTP status code.
+            code = e.response.get("Error", {}).get("Code")
+            if code in ("404", "NoSuchKey"):
+                # Does not exist
+                logger.debug("has key %r -> miss", key)
+                if self._metadata_cache is not None:
+                    self._metadata_cache.set(key, False)
+            elif code in ("403", "NoSuchBucket"):
+                # Unauthorized/invalid bucket
+                logger.error("has key %r -> unauthorized", key)
+            else:
+                # In case of an error we can't handle, log it, and fail
+                # gracefully. A cache miss is better than a poisoned cache.
+                logger.exception("has key %r -> error", key)
+            return None
+        except botocore.exceptions.BotoCoreError:
+            # Likewise for timeouts and other connection errors
+            logger.exception("has key %r -> error", key)
+            return None
+
+        return result
+
+    def _purge(self, key: str):
+        """
+        Remove the (expired or invalid) item identified by ``key`` from S3.
+
+        If ``purge_in_background`` is set, the item is only queued for removal.
+
+        :param key: The unique identifier for the relevant item.
+        """
+        if self._metadata_cache is not None:
+            self._metadata_cache.discard(key)
+
+        if not self.purge_in_background:
+            self._s3_client.delete_object(Bucket=self._bucket_name, Key=key)
+            return
+
+        with self._purge_thread_lock:
+            if self._purge_thread is None:
+                # The thread only holds a weak reference to this instance, so
+                # that it doesn't keep it alive; once the instance is garbage,
+                # the thread is told to stop.
+                self._purge_thread = threading.Thread(
+                    target=self._drain_purge_queue,
+                    args=(weakref.ref(self), self._purge_queue),
+                    name="s3cache-purge",
+                    daemon=True,
+                )
+                self._purge_thread.start()
+                weakref.finalize(self, self._purge_queue.put, None).atexit = False
+                _purging.add(self)
+            self._purge_queue.put(key)
+
+    @staticmethod
+    def _drain_purge_queue(
+        cache_ref: weakref.ReferenceType[S3Cache],
+        purge_queue: queue.SimpleQueue[t.Optional[str]],
+    ):
+        """
+        Delete keys queued for purging in bulk, until told to stop, or until
+        the cache instance is garbage. Runs in the background thread.
+
+        :param cache_ref: Weak reference to the cache instance.
+        :param purge_queue: Queue of keys to purge.
+        """
+        stopping = False
+        while not stopping:
+            # Block until there's something to do, then take whatever else
+            # has accumulated in the meantime.
+            keys = [purge_queue.get()]
+            while len(keys) < DELETE_BATCH_SIZE:
+                try:
+                    keys.append(purge_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in keys:
+                stopping = True
+                keys = [key for key in keys if key is not None]
+            if not keys:
+                continue
+
+            cache = cache_ref()
+            if cache is None:
+                return
+            try:
+                cache._delete_many(keys)
+            except Exception:
+                # Don't let a failure stop the thread; the items stay expired
+                # and will be queued again when next encountered.
+                logger.exception("could not purge %d keys", len(keys))
+            # Don't keep the instance alive while waiting for more keys
+            del cache
+
+    def _stop_purging(self, timeout: t.Optional[float] = None):
+        """
+        Purge the keys queued so far, then stop the background thread.
+
+        Keys queued later start a new thread.
+
+        :param timeout: Seconds to wait for the thread to finish.
+        """
+        with self._purge_thread_lock:
+            thread, self._purge_thread = self._purge_thread, None
+            if thread is None:
+                return
+            purge_queue, self._purge_queue = self._purge_queue, queue.SimpleQueue()
+            purge_queue.put(None)
+
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning("background purge did not finish in time")
+
+    def _cached_has(self, key: str) -> t.Optional[bool]:
+        """
+        Existence check for ``key`` using only the in-process metadata cache.
+
+        Returns ``None`` if S3 has to be queried, which includes expired items
+        that should be purged, so that purging happens on the regular path.
+
+        :param key: The unique identifier for the relevant item.
+        """
+        if self._metadata_cache is None:
+            return None
+
+        cached = self._metadata_cache.get(key)
+        if cached is None:
+            return None
+
+        exists, expires = cached
+        if not exists:
+            return False
+        if expires is None or expires >= self._now_ts():
+            return True
+        return None if self.purge_expired_on_read else False
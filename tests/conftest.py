@@ -4,14 +4,21 @@ Basic test fixtures
 """
 
 from __future__ import annotations
+import os
 import typing as t
 import pytest
 
-from localstack_client.patch import enable_local_endpoints
+from filelock import FileLock
+from lovely.pytest.docker.compose import Services
+from localstack_client.patch import enable_local_endpoints, disable_local_endpoints
 from flask import Flask
 from flask_caching import Cache
 
 import boto3
+import botocore.endpoint
+from botocore.config import Config
+
+from flask_caching_s3 import S3Cache
 
 if t.TYPE_CHECKING:
     from mypy_boto3_s3 import S3ServiceResource
@@ -21,21 +28,88 @@ T = t.TypeVar("T")
 YieldFixture = t.Generator[T, None, None]
 
 
-@pytest.fixture(autouse=True)
-def patch_boto3_for_localstack():
+def _reset_shared_resources():
+    """Drop boto3 resources S3Cache shares between instances"""
+    S3Cache._resource_cache.clear()
+    S3Cache._conditional_writes.clear()
+
+
+@pytest.fixture(scope="session")
+def localstack_endpoints() -> YieldFixture[None]:
+    """
+    Point boto3 connections at localstack, for tests that talk to S3
+    """
+    # Resources created before patching would still point at AWS
+    _reset_shared_resources()
+    enable_local_endpoints()
+
+    yield
+
+    disable_local_endpoints()
+    _reset_shared_resources()
+
+
+@pytest.fixture
+def no_aws_requests(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Fail the test if botocore tries to send any request"""
+
+    def make_request(self, operation_model, request_dict):
+        pytest.fail(f"Unexpected {operation_model.name} request to {self.host}")
+
+    monkeypatch.setattr(botocore.endpoint.Endpoint, "make_request", make_request)
+
+
+@pytest.fixture(scope="session")
+def docker_services(
+    docker_compose_files: t.List[str],
+    docker_ip: str,
+    docker_services_project_name: str,
+) -> Services:
     """
-    Mock out any boto3 connections to use localstack
+    The docker compose services, which ``docker_localstack`` starts and stops.
+
+    This replaces lovely-pytest-docker's fixture, which takes the services down
+    at the end of every session; under pytest-xdist, that's the end of the
+    first worker to finish, while the others may still be using them.
     """
-    yield enable_local_endpoints()
+    return Services(docker_compose_files, docker_ip, docker_services_project_name)
 
 
 @pytest.fixture(scope="session")
-def docker_localstack(docker_services):
-    """Start the localstack service for the integration tests"""
+def docker_localstack(
+    docker_services: Services,
+    pytestconfig: pytest.Config,
+    tmp_path_factory: pytest.TempPathFactory,
+) -> YieldFixture[str]:
+    """
+    Start the localstack service for the integration tests
+
+    pytest-xdist workers share a single service: the first of them to need it
+    starts it, and the last one to finish stops it, unless ``--keepalive`` is
+    given.
+    """
+    # Each pytest-xdist worker has a temporary directory of its own, within
+    # one that they share.
+    shared_dir = tmp_path_factory.getbasetemp()
+    if os.environ.get("PYTEST_XDIST_WORKER"):
+        shared_dir = shared_dir.parent
+    users = shared_dir / "localstack.users"
+    lock = FileLock(f"{users}.lock")
+
+    with lock:
+        count = int(users.read_text()) if users.exists() else 0
+        if not count:
+            docker_services.start("localstack")
+        users.write_text(str(count + 1))
 
-    docker_services.start("localstack")
     public_port = docker_services.wait_for_service("localstack", 4566)
-    return f"{docker_services.docker_ip}:{public_port}"
+    yield f"{docker_services.docker_ip}:{public_port}"
+
+    with lock:
+        count = int(users.read_text()) - 1
+        users.write_text(str(count))
+        if not count and not pytestconfig.getoption("--keepalive"):
+            docker_services.shutdown()
 
 
 @pytest.fixture
@@ -45,69 +119,91 @@ def flask_app() -> YieldFixture[Flask]:
     yield Flask("flask-caching-s3-test")
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def default_bucket_name() -> str:
     """Default name of bucket for tests/fixtures to use."""
+
+    # Give each pytest-xdist worker a bucket of its own
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+    if worker:
+        return f"library-of-alexandria-{worker}"
     return "library-of-alexandria"
 
 
-@pytest.fixture()
+@pytest.fixture(scope="session")
 def default_cache_prefix() -> str:
     """Default cache prefix."""
     return "test_prefix_"
 
 
 @pytest.fixture
-def cache(
-    flask_app: Flask, default_bucket_name: str, default_cache_prefix: str
-) -> YieldFixture[Cache]:
-    """Initialize cache"""
+def make_cache(
+    localstack_endpoints: None,
+    flask_app: Flask,
+    default_bucket_name: str,
+    default_cache_prefix: str,
+) -> t.Callable[..., Cache]:
+    """Factory fixture for caches that are initialized with the given options"""
+
+    def init_cache(**options: t.Any) -> Cache:
+        cache = Cache()
+        cache.init_app(
+            flask_app,
+            {
+                "CACHE_TYPE": "flask_caching_s3.S3Cache",
+                "CACHE_S3_BUCKET": default_bucket_name,
+                "CACHE_KEY_PREFIX": default_cache_prefix,
+                "CACHE_OPTIONS": options,
+            },
+        )
+        return cache
+
+    return init_cache
 
-    cache = Cache()
-    cache.init_app(
-        flask_app,
-        {
-            "CACHE_TYPE": "flask_caching_s3.S3Cache",
-            "CACHE_S3_BUCKET": default_bucket_name,
-            "CACHE_KEY_PREFIX": default_cache_prefix,
-        },
-    )
-    yield cache
+
+@pytest.fixture
+def cache(make_cache: t.Callable[..., Cache]) -> Cache:
+    """Initialize cache"""
+    return make_cache()
 
 
 @pytest.fixture
-def purging_cache(
-    flask_app: Flask, default_bucket_name: str, default_cache_prefix: str
-) -> YieldFixture[Cache]:
+def purging_cache(make_cache: t.Callable[..., Cache]) -> Cache:
     """Initialize cache that purges expired items on read"""
+    return make_cache(purge_expired_on_read=True)
 
-    cache = Cache()
-    cache.init_app(
-        flask_app,
-        {
-            "CACHE_TYPE": "flask_caching_s3.S3Cache",
-            "CACHE_S3_BUCKET": default_bucket_name,
-            "CACHE_KEY_PREFIX": default_cache_prefix,
-            "CACHE_OPTIONS": {"purge_expired_on_read": True},
-        },
-    )
-    yield cache
+
+@pytest.fixture
+def metadata_caching_cache(make_cache: t.Callable[..., Cache]) -> Cache:
+    """Initialize cache that remembers item metadata in-process"""
+    return make_cache(metadata_cache_enabled=True)
 
 
 @pytest.fixture
-def s3(docker_localstack) -> YieldFixture[S3ServiceResource]:
+def sharded_cache(make_cache: t.Callable[..., Cache]) -> Cache:
+    """Initialize cache that spreads keys over 16 shards"""
+    return make_cache(shard_bits=4)
+
+
+@pytest.fixture(scope="session")
+def s3(
+    docker_localstack, localstack_endpoints: None
+) -> YieldFixture[S3ServiceResource]:
     """A boto3 resource to use for the test suite."""
 
-    yield boto3.resource("s3")
+    yield boto3.resource(
+        "s3",
+        config=Config(max_pool_connections=64, retries={"total_max_attempts": 1}),
+    )
 
 
-@pytest.fixture(scope="function")
+@pytest.fixture(scope="session")
 def default_bucket(
     s3: S3ServiceResource, default_bucket_name: str
 ) -> YieldFixture[S3Bucket]:
     """
-    Create the default bucket to be used for tests, and clean up after
-    ourselves.
+    Create the default bucket to be used for the test session, and clean up
+    after ourselves.
     """
     bucket_handle = s3.create_bucket(Bucket=default_bucket_name)
 
@@ -116,3 +212,12 @@ def default_bucket(
     # Clean up
     bucket_handle.objects.all().delete()
     bucket_handle.delete()
+
+
+@pytest.fixture
+def _cleanup(default_bucket: S3Bucket, default_cache_prefix: str) -> YieldFixture[None]:
+    """Remove any cached items a test leaves behind in the default bucket"""
+
+    yield
+
+    default_bucket.objects.filter(Prefix=default_cache_prefix).delete()
@@ -3,15 +3,29 @@ Flask-Caching initialization/configuration tests for S3Cache backend
 """
 
 from __future__ import annotations
+import logging
 import typing as t
 
+import pytest
 from flask_caching import Cache
 
+from flask_caching_s3 import S3Cache
+
 if t.TYPE_CHECKING:
     from flask import Flask
 
 
-def test_initialize_cache_extension_with_import_path(flask_app: Flask):
+@pytest.fixture
+def fresh_resources(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Keep the boto3 resources created by a test from being shared"""
+
+    monkeypatch.setattr(S3Cache, "_resource_cache", {})
+    monkeypatch.setattr(S3Cache, "_conditional_writes", {})
+
+
+def test_initialize_cache_extension_with_import_path(
+    flask_app: Flask, no_aws_requests: None
+):
     """
     Initialize Flask-Caching with S3Cache backend.
 
@@ -29,7 +43,9 @@ def test_initialize_cache_extension_with_import_path(flask_app: Flask):
     cache.init_app(flask_app)
 
 
-def test_initialize_cache_extension_with_direct_configuration(flask_app: Flask):
+def test_initialize_cache_extension_with_direct_configuration(
+    flask_app: Flask, no_aws_requests: None
+):
     """
     Initialize ``Flask-Caching`` by passing config options to ``init_app`` directly.
     """
@@ -43,3 +59,81 @@ def test_initialize_cache_extension_with_direct_configuration(flask_app: Flask):
     )
 
     assert cache.app == flask_app
+
+
+def test_client_configuration(no_aws_requests: None, fresh_resources: None):
+    """
+    Client options end up in the configuration of the boto3 client.
+    """
+
+    cache = S3Cache(
+        "library-of-alexandria",
+        max_workers=4,
+        max_attempts=3,
+        retry_mode="standard",
+        connect_timeout=0.5,
+        read_timeout=2.0,
+        tcp_keepalive=False,
+        parameter_validation=True,
+    )
+
+    config = cache._s3_client.meta.config
+    assert config.retries == {"total_max_attempts": 3, "mode": "standard"}
+    assert config.connect_timeout == 0.5
+    assert config.read_timeout == 2.0
+    assert config.tcp_keepalive is False
+    assert config.parameter_validation is True
+    # Never fewer than 20 connections, however few workers there are
+    assert config.max_pool_connections == 20
+
+
+def test_shared_resources(no_aws_requests: None, fresh_resources: None):
+    """
+    Caches share a boto3 resource, as long as they use the same endpoint and
+    client configuration.
+    """
+
+    first = S3Cache("library-of-alexandria", connect_timeout=0.5)
+    same = S3Cache("another-bucket", key_prefix="other_", connect_timeout=0.5)
+    other_config = S3Cache("library-of-alexandria", connect_timeout=2.0)
+    other_endpoint = S3Cache(
+        "library-of-alexandria",
+        connect_timeout=0.5,
+        CACHE_S3_ENDPOINT_URL="http://localhost:4566",
+    )
+
+    assert same._client is first._client
+    assert other_config._client is not first._client
+    assert other_endpoint._client is not first._client
+    assert len(S3Cache._resource_cache) == 3
+
+
+def test_unreachable_endpoint(
+    fresh_resources: None,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+):
+    """
+    Connection errors are logged, and treated as misses when reading, just
+    like errors reported by S3.
+    """
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    # Nothing listens on the discard port
+    cache = S3Cache(
+        "library-of-alexandria",
+        max_attempts=1,
+        CACHE_S3_ENDPOINT_URL="http://127.0.0.1:9",
+    )
+
+    with caplog.at_level(logging.ERROR, logger="flask_caching_s3"):
+        assert cache.get("key") is None
+        assert cache.has("key") is False
+
+    assert [record.getMessage() for record in caplog.records] == [
+        "get key 'key' -> error",
+        "has key 'key' -> error",
+    ]
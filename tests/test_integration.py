@@ -10,13 +10,20 @@ be started by the relevant test fixtures, which read the sibling
 from __future__ import annotations
 
 import datetime
+import gc
+import os
+import time
 import typing as t
-import io
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 
 import pytest
 
 from flask_caching import Cache
-from freezegun import freeze_time
+
+from flask_caching_s3 import DELETE_BATCH_SIZE, HAS_CRT, S3Cache
 
 
 if t.TYPE_CHECKING:
@@ -25,43 +32,122 @@ if t.TYPE_CHECKING:
     from mypy_boto3_s3.service_resource import Bucket as S3Bucket
 
 
-class CachedItemMaker(t.Protocol):
-    def __call__(
-        self,
-        bucket: S3Bucket,
-        key: str,
-        value: t.Any,
-        expires_at: t.Optional[datetime.datetime] = None,
-    ) -> S3Object:
-        ...
+pytestmark = pytest.mark.usefixtures("_cleanup")
 
+BODY_CHUNK_SIZE = 64 * 1024
 
-@pytest.fixture(scope="function")
-def cache_item(
-    default_cache_prefix: str,
-) -> CachedItemMaker:
-    """Factory fixture for quickly adding an item to S3"""
 
-    def add_item_to_s3(
-        bucket: S3Bucket,
+@dataclass
+class CachedItemMaker:
+    """Add items to S3 the way the cache stores them, for tests to read"""
+
+    prefix: str
+    bucket: S3Bucket
+
+    def __call__(
+        self,
         key: str,
         value: t.Any,
         expires_at: t.Optional[datetime.datetime] = None,
     ) -> S3Object:
-        object = bucket.Object(key=f"{default_cache_prefix}{key}")
+        object = self.bucket.Object(key=f"{self.prefix}{key}")
         metadata = {}
 
         if expires_at is not None:
             metadata = {"expires_at": str(int(expires_at.timestamp()))}
 
-        object.put(Body=io.BytesIO(bytes(value, "utf-8")), Metadata=metadata)
+        object.put(Body=value.encode("utf-8"), Metadata=metadata)
         return object
 
-    return add_item_to_s3
+
+def _now() -> datetime.datetime:
+    """The current UTC time, to the second"""
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+
+
+@pytest.fixture
+def unique_key() -> t.Callable[[str], str]:
+    """
+    Factory fixture for cache keys that no other test, or test worker, uses
+    """
+
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "gw0")
+    return lambda base: f"{base}-{worker}-{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture
+def now_utc() -> datetime.datetime:
+    """The time the test started, to the second"""
+    return _now()
+
+
+class StoredItem(t.NamedTuple):
+    body: bytes
+    metadata: t.Dict[str, str]
+    expires: t.Optional[datetime.datetime]
+
+
+def read_body(response: t.Mapping[str, t.Any]) -> bytes:
+    """Read the body of a ``GetObject`` response in fixed-size chunks"""
+    return b"".join(response["Body"].iter_chunks(BODY_CHUNK_SIZE))
+
+
+def assert_body_equals(response: t.Mapping[str, t.Any], expected: bytes):
+    """
+    Compare the body of a ``GetObject`` response to ``expected`` chunk by
+    chunk, without reading the whole body into memory
+    """
+
+    offset = 0
+    for chunk in response["Body"].iter_chunks(BODY_CHUNK_SIZE):
+        assert chunk == expected[offset : offset + len(chunk)]
+        offset += len(chunk)
+    assert offset == len(expected)
+
+
+def fetch_with_meta(bucket: S3Bucket, key: str) -> StoredItem:
+    """
+    Fetch an object's body and expiration details from S3 in a single
+    ``GetObject`` request
+    """
+
+    stored = bucket.meta.client.get_object(Bucket=bucket.name, Key=key)
+    return StoredItem(read_body(stored), stored["Metadata"], stored.get("Expires"))
+
+
+def bulk_cache_items(
+    bucket: S3Bucket, items: t.Mapping[str, str], prefix: str
+) -> t.List[S3Object]:
+    """Add several items to S3 at once, uploading them concurrently"""
+
+    with ThreadPoolExecutor(max_workers=min(32, len(items))) as executor:
+        futures = [
+            executor.submit(
+                bucket.meta.client.put_object,
+                Bucket=bucket.name,
+                Key=f"{prefix}{key}",
+                Body=value.encode("utf-8"),
+            )
+            for key, value in items.items()
+        ]
+        for future in as_completed(futures):
+            future.result()
+
+    return [bucket.Object(key=f"{prefix}{key}") for key in items]
+
+
+@pytest.fixture(scope="session")
+def cache_item(default_cache_prefix: str, default_bucket: S3Bucket) -> CachedItemMaker:
+    """Factory fixture for quickly adding an item to S3"""
+
+    return CachedItemMaker(default_cache_prefix, default_bucket)
 
 
 def test_simple_cache_set(
-    cache: Cache, default_bucket: S3Bucket, default_cache_prefix: str
+    cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
 ):
     """
     Set an item in the cache, and verify that it has been added by querying S3
@@ -70,32 +156,205 @@ def test_simple_cache_set(
     Default expiration time is set.
     """
 
-    now = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
+    key = unique_key("key")
+    pre = int(time.time())
+    result = cache.set(key, "something I'd like to cache")
+    post = int(time.time())
+    assert result is True
+
+    stored = fetch_with_meta(default_bucket, f"{default_cache_prefix}{key}")
+    assert stored.body.decode() == "something I'd like to cache"
+
+    expires_at = int(stored.metadata["expires_at"])
+
+    assert pre + 300 <= expires_at <= post + 300
+    assert stored.expires == datetime.datetime.fromtimestamp(
+        expires_at, tz=datetime.timezone.utc
     )
 
-    with freeze_time(now):
-        result = cache.set("key", "something I'd like to cache")
-        assert result is True
+    # Metadata expirations are fixed-width
+    assert len(stored.metadata["expires_at"]) == 10
 
-    stored = default_bucket.Object(key=f"{default_cache_prefix}key").get()
 
-    # Raw data from S3 is in streaming bytes, so let's read it.
-    value = stored["Body"].read()
-    assert value.decode() == "something I'd like to cache"
+def test_cache_set_bytes(
+    cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    Values that are already bytes are stored as they are, without being
+    converted to a string first.
+    """
 
-    expiration = datetime.datetime.fromtimestamp(
-        int(stored["Metadata"]["expires_at"]), tz=datetime.timezone.utc
+    key = unique_key("key")
+    value = "Ĉu vi parolas Esperanton?".encode("utf-8")
+
+    result = cache.set(key, value)
+    assert result is True
+
+    assert_body_equals(
+        default_bucket.Object(key=f"{default_cache_prefix}{key}").get(), value
     )
 
-    assert now < expiration
-    assert expiration == (now + datetime.timedelta(seconds=300))
 
+@pytest.mark.parametrize(
+    "value",
+    [b"\x80\x81\xff", "Ĉu vi parolas Esperanton?".encode("utf-8"), b""],
+    ids=["binary", "utf-8", "empty"],
+)
+def test_cache_get_bytes(
+    cache: Cache, unique_key: t.Callable[[str], str], value: bytes
+):
+    """
+    Values stored as bytes are returned as bytes, whether or not they happen
+    to be valid UTF-8.
+    """
 
-def test_simple_cache_get(
+    key = unique_key("key")
+    assert cache.set(key, value) is True
+
+    result = cache.get(key)
+    assert isinstance(result, bytes)
+    assert result == value
+
+
+@pytest.mark.skipif(not HAS_CRT, reason="requires the crt extra")
+def test_cache_large_item(
+    make_cache: t.Callable[..., Cache],
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    Items from ``multipart_threshold`` bytes are transferred in parts, while
+    smaller ones, including empty ones, still take a single request.
+    """
+
+    cache = make_cache(multipart_threshold=1024, decode_responses=False)
+
+    items = {
+        unique_key("large"): bytes(range(256)) * 64,
+        unique_key("small"): b"The rest is silence.",
+        unique_key("empty"): b"",
+    }
+    for key, value in items.items():
+        assert cache.set(key, value, timeout=300) is True
+
+        stored = fetch_with_meta(default_bucket, f"{default_cache_prefix}{key}")
+        assert stored.body == value
+        assert stored.expires is not None
+        assert "expires_at" in stored.metadata
+
+        assert cache.get(key) == value
+
+    # The large item went through the transfer manager, and was read in parts
+    assert cache.cache._transfer is not None
+    assert cache.cache._part_executor is not None
+
+
+@pytest.mark.skipif(not HAS_CRT, reason="requires the crt extra")
+def test_cache_get_expired_large_item(
+    make_cache: t.Callable[..., Cache],
+    cache_item: CachedItemMaker,
+    now_utc: datetime.datetime,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    Large items are checked for expiration before the rest of their parts are
+    fetched.
+    """
+
+    cache = make_cache(multipart_threshold=1024)
+
+    key = unique_key("large")
+    yesterday = now_utc - datetime.timedelta(days=1)
+    cache_item(key, "x" * 4096, expires_at=yesterday)
+
+    assert cache.get(key) is None
+
+
+@pytest.mark.skipif(not HAS_CRT, reason="requires the crt extra")
+def test_cache_get_large_item_replaced_while_reading(
+    make_cache: t.Callable[..., Cache],
+    cache_item: CachedItemMaker,
+    now_utc: datetime.datetime,
+    unique_key: t.Callable[[str], str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """
+    If a large item is replaced between reading its first part, and checking
+    its expiration, and reading the rest of it, the read is a miss rather than
+    a mix of both items.
+    """
+
+    cache = make_cache(multipart_threshold=1024)
+
+    key = unique_key("large")
+    cache_item(key, "x" * 4096)
+
+    client = cache.cache._s3_client
+    get_object = client.get_object
+
+    def get_object_then_replace(**kwargs):
+        result = get_object(**kwargs)
+        if "IfMatch" not in kwargs:
+            yesterday = now_utc - datetime.timedelta(days=1)
+            cache_item(key, "y" * 4096, expires_at=yesterday)
+        return result
+
+    monkeypatch.setattr(client, "get_object", get_object_then_replace)
+
+    assert cache.get(key) is None
+
+
+@pytest.mark.parametrize("value", [5, {"x": 1, "n": [1, 2]}], ids=["int", "dict"])
+def test_cache_set_unsupported_type(
     cache: Cache,
     default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    s3: S3ServiceResource,
+    unique_key: t.Callable[[str], str],
+    value: t.Any,
+):
+    """
+    Values other than strings and bytes are refused, rather than being stored
+    as their string representation and read back as such.
+    """
+
+    key = unique_key("key")
+
+    with pytest.raises(TypeError):
+        cache.set(key, value)
+
+    with pytest.raises(s3.meta.client.exceptions.NoSuchKey):
+        default_bucket.Object(key=f"{default_cache_prefix}{key}").get()
+
+
+def test_cache_get_without_decoding(
+    make_cache: t.Callable[..., Cache],
+    cache_item: CachedItemMaker,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    With ``decode_responses`` disabled, items are returned as the raw bytes
+    stored in S3.
+    """
+
+    cache = make_cache(decode_responses=False)
+
+    key = unique_key("key")
+    value = "Ĉu vi parolas Esperanton?"
+    cache_item(key, value)
+
+    assert cache.get(key) == value.encode("utf-8")
+    assert cache.get(unique_key("missing_key")) is None
+
+
+def test_simple_cache_get(
+    cache: Cache,
     cache_item: CachedItemMaker,
+    unique_key: t.Callable[[str], str],
 ):
     """
     Get an item that has already been persisted to the cache.
@@ -103,46 +362,74 @@ def test_simple_cache_get(
     For the purposes of this test, no expiration is set.
     """
 
-    key = "polonius_2_2"
+    key = unique_key("polonius_2_2")
     value = "Brevity is the soul of wit."
-    cache_item(default_bucket, key=key, value=value)
+    cache_item(key=key, value=value)
 
     result = cache.get(key)
     assert result == value
 
 
-def test_simple_cache_get_missing_item(cache: Cache, default_bucket: S3Bucket):
+def test_simple_cache_get_missing_item(
+    cache: Cache,
+    default_bucket: S3Bucket,
+    unique_key: t.Callable[[str], str],
+):
     """
     Attempt to get an item that doesn't exist in the cache.
     """
 
-    key = "missing_key"
+    key = unique_key("missing_key")
     result = cache.get(key)
     assert result is None
 
 
 def test_simple_cache_get_expired_item(
-    cache: Cache, default_bucket: S3Bucket, cache_item: CachedItemMaker
+    cache: Cache,
+    cache_item: CachedItemMaker,
+    now_utc: datetime.datetime,
+    unique_key: t.Callable[[str], str],
 ):
     """
     Attempt to get an item that exists in the cache but has expired.
     """
 
-    key = "expiration_test_key"
+    key = unique_key("expiration_test_key")
     value = "This value is no longer valid."
 
     # compute expiration time that is set in the past
-    yesterday = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
-    ) - datetime.timedelta(days=1)
+    yesterday = now_utc - datetime.timedelta(days=1)
 
-    object = cache_item(default_bucket, key=key, value=value, expires_at=yesterday)
+    object = cache_item(key=key, value=value, expires_at=yesterday)
 
     result = cache.get(key)
     assert result is None
 
     # Item should not be purged, by default, so it should still exist in S3
-    assert object.get()["Body"].read().decode() == value
+    assert_body_equals(object.get(), value.encode("utf-8"))
+
+
+def test_simple_cache_get_item_set_in_the_past(
+    cache: Cache,
+    default_bucket: S3Bucket,
+    now_utc: datetime.datetime,
+    monkeypatch: pytest.MonkeyPatch,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    Attempt to get an item that was set by the cache itself, and has since
+    expired.
+    """
+
+    key = unique_key("expiration_test_key")
+    yesterday = now_utc - datetime.timedelta(days=1)
+
+    with monkeypatch.context() as m:
+        m.setattr(S3Cache, "_now_ts", lambda self: yesterday.timestamp())
+        cache.set(key, "This value is no longer valid.", timeout=300)
+
+    assert cache.get(key) is None
+    assert cache.has(key) is False
 
 
 def test_simple_cache_get_expired_item_purge(
@@ -150,21 +437,20 @@ def test_simple_cache_get_expired_item_purge(
     default_bucket: S3Bucket,
     cache_item: CachedItemMaker,
     s3: S3ServiceResource,
+    now_utc: datetime.datetime,
+    unique_key: t.Callable[[str], str],
 ):
     """
     Attempt to get an item that exists in the cache but has expired, which
     will purge the item from S3.
     """
 
-    key = "expiration_test_key"
+    key = unique_key("expiration_test_key")
     value = "This value is no longer valid."
 
     # compute expiration time that is set in the past
-    now = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
-    )
-    yesterday = now - datetime.timedelta(days=1)
-    object = cache_item(default_bucket, key, value, expires_at=yesterday)
+    yesterday = now_utc - datetime.timedelta(days=1)
+    object = cache_item(key, value, expires_at=yesterday)
 
     result = purging_cache.get(key)
     assert result is None
@@ -174,8 +460,191 @@ def test_simple_cache_get_expired_item_purge(
         # default_bucket.Object(key=f"{default_cache_prefix}{key}").get()
 
 
+def test_simple_cache_get_expired_item_purge_in_background(
+    make_cache: t.Callable[..., Cache],
+    cache_item: CachedItemMaker,
+    s3: S3ServiceResource,
+    now_utc: datetime.datetime,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    Attempt to get an item that has expired, with a cache that purges it from
+    S3 in a background thread.
+    """
+
+    cache = make_cache(purge_expired_on_read=True, purge_in_background=True)
+    backend: S3Cache = cache.cache
+
+    key = unique_key("expiration_test_key")
+    yesterday = now_utc - datetime.timedelta(days=1)
+    object = cache_item(key, "This value is no longer valid.", expires_at=yesterday)
+
+    assert cache.get(key) is None
+    thread = backend._purge_thread
+    assert thread is not None
+
+    # Stopping the thread, as happens at exit, waits for the queue to drain
+    backend._stop_purging(timeout=5)
+    assert not thread.is_alive()
+    assert backend._purge_thread is None
+
+    with pytest.raises(s3.meta.client.exceptions.NoSuchKey):
+        object.get()
+
+    # Purging again, once stopped, starts a new thread
+    key = unique_key("expiration_test_key")
+    object = cache_item(key, "This value is no longer valid.", expires_at=yesterday)
+
+    assert cache.get(key) is None
+    assert backend._purge_thread is not None
+    assert backend._purge_thread is not thread
+
+    backend._stop_purging(timeout=5)
+
+    with pytest.raises(s3.meta.client.exceptions.NoSuchKey):
+        object.get()
+
+
+def test_purge_in_background_does_not_keep_cache_alive(
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    cache_item: CachedItemMaker,
+    s3: S3ServiceResource,
+    now_utc: datetime.datetime,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    The background purge thread doesn't keep the cache alive, and stops once
+    the cache is garbage.
+    """
+
+    backend = S3Cache(
+        default_bucket.name,
+        key_prefix=default_cache_prefix,
+        purge_expired_on_read=True,
+        purge_in_background=True,
+    )
+
+    key = unique_key("expiration_test_key")
+    yesterday = now_utc - datetime.timedelta(days=1)
+    object = cache_item(key, "This value is no longer valid.", expires_at=yesterday)
+
+    assert backend.get(key) is None
+    thread = backend._purge_thread
+    assert thread is not None
+
+    # Let the thread purge the key, and go back to waiting for more
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            object.load()
+        except s3.meta.client.exceptions.ClientError:
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail("the expired item was not purged")
+
+    backend_ref = weakref.ref(backend)
+    del backend
+    gc.collect()
+
+    assert backend_ref() is None
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_cache_get_many(
+    cache: Cache,
+    cache_item: CachedItemMaker,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    Get several items at once; missing items are returned as ``None``, in
+    the position of their key.
+    """
+
+    one, two = unique_key("one"), unique_key("two")
+    cache_item(one, "existing value 1")
+    cache_item(two, "existing value 2")
+
+    result = cache.get_many(one, unique_key("missing_key"), two)
+    assert result == ["existing value 1", None, "existing value 2"]
+
+
+def test_cache_set_many(
+    cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
+):
+    """Set several items at once."""
+
+    data = {unique_key("one"): "new value 1", unique_key("two"): "new value 2"}
+
+    result = cache.set_many(data)
+    assert sorted(result) == sorted(data)
+
+    for key, value in data.items():
+        assert_body_equals(
+            default_bucket.Object(key=f"{default_cache_prefix}{key}").get(),
+            value.encode("utf-8"),
+        )
+
+
+def test_simple_cache_get_item_with_invalid_expiration(
+    cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    Attempt to get an item whose expiration metadata can't be understood,
+    which is treated as a miss.
+    """
+
+    key = unique_key("polonius_2_2")
+    object = default_bucket.put_object(
+        Key=f"{default_cache_prefix}{key}",
+        Body=b"Brevity is the soul of wit.",
+        Metadata={"expires_at": "tomorrow"},
+    )
+
+    assert cache.get(key) is None
+
+    # Item should not be purged, by default, so it should still exist in S3
+    assert_body_equals(object.get(), b"Brevity is the soul of wit.")
+
+
+def test_simple_cache_get_item_with_invalid_expiration_purge(
+    purging_cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    s3: S3ServiceResource,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    Attempt to get an item whose expiration metadata can't be understood,
+    which will purge the item from S3.
+    """
+
+    key = unique_key("polonius_2_2")
+    object = default_bucket.put_object(
+        Key=f"{default_cache_prefix}{key}",
+        Body=b"Brevity is the soul of wit.",
+        Metadata={"expires_at": "tomorrow"},
+    )
+
+    assert purging_cache.get(key) is None
+
+    with pytest.raises(s3.meta.client.exceptions.NoSuchKey):
+        object.get()
+
+
 def test_simple_cache_add(
-    cache: Cache, default_bucket: S3Bucket, default_cache_prefix: str
+    cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
 ):
     """
     Add an item to the cache.
@@ -187,16 +656,16 @@ def test_simple_cache_add(
     not be updated.
     """
 
-    key = "hamlet_5_2"
+    key = unique_key("hamlet_5_2")
     expected_value = "The rest is silence."
 
     result = cache.add(key, expected_value)
     assert result is True
 
-    stored = default_bucket.Object(key=f"{default_cache_prefix}{key}").get()
-    # Raw data from S3 is in streaming bytes, so let's read it.
-    data = stored["Body"].read()
-    assert data.decode() == expected_value
+    assert_body_equals(
+        default_bucket.Object(key=f"{default_cache_prefix}{key}").get(),
+        expected_value.encode("utf-8"),
+    )
 
     # Now attempt to call cache.add() again with the same key, but
     # a different value
@@ -205,57 +674,177 @@ def test_simple_cache_add(
     assert result is False
 
     # check that the original value hasn't been overwritten.
-    stored = default_bucket.Object(key=f"{default_cache_prefix}{key}").get()
-    data = stored["Body"].read()
-    assert data.decode() == expected_value
+    assert_body_equals(
+        default_bucket.Object(key=f"{default_cache_prefix}{key}").get(),
+        expected_value.encode("utf-8"),
+    )
+
+
+def test_cache_add_with_stale_metadata_cache(
+    metadata_caching_cache: Cache,
+    default_bucket: S3Bucket,
+    cache_item: CachedItemMaker,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    An item written by another client is not overwritten by ``add``, even
+    while the metadata cache still remembers it as missing.
+    """
+
+    key = unique_key("hamlet_5_2")
+    assert metadata_caching_cache.has(key) is False
+
+    # Another client writes the item behind the cache's back
+    object = cache_item(key, "The rest is silence.")
+
+    result = metadata_caching_cache.add(key, "Goodnight, sweet prince")
+    assert result is False
+
+    assert_body_equals(object.get(), b"The rest is silence.")
+
+
+def test_cache_add_over_expired_item(
+    cache: Cache,
+    cache_item: CachedItemMaker,
+    now_utc: datetime.datetime,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    ``add`` replaces an item that has expired.
+    """
+
+    key = unique_key("hamlet_5_2")
+    yesterday = now_utc - datetime.timedelta(days=1)
+    object = cache_item(key, "The rest is silence.", expires_at=yesterday)
+
+    assert cache.add(key, "Goodnight, sweet prince") is True
+
+    assert_body_equals(object.get(), b"Goodnight, sweet prince")
+    assert cache.get(key) == "Goodnight, sweet prince"
+
+
+def test_cache_add_over_expired_item_replaced_concurrently(
+    cache: Cache,
+    cache_item: CachedItemMaker,
+    now_utc: datetime.datetime,
+    unique_key: t.Callable[[str], str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """
+    If another client replaces an expired item between ``add`` finding that it
+    has expired and replacing it, ``add`` leaves the other client's item be.
+    """
+
+    key = unique_key("hamlet_5_2")
+    yesterday = now_utc - datetime.timedelta(days=1)
+    object = cache_item(key, "The rest is silence.", expires_at=yesterday)
+
+    client = cache.cache._s3_client
+    head_object = client.head_object
+
+    def head_object_then_replace(**kwargs):
+        result = head_object(**kwargs)
+        cache_item(key, "Flights of angels sing thee to thy rest!")
+        return result
+
+    monkeypatch.setattr(client, "head_object", head_object_then_replace)
+
+    assert cache.add(key, "Goodnight, sweet prince") is False
+
+    assert_body_equals(object.get(), b"Flights of angels sing thee to thy rest!")
+
+
+def test_cache_add_without_conditional_writes(
+    cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """
+    If the S3 endpoint rejects conditional writes, ``add`` stops attempting
+    them and falls back to checking whether the item exists before setting it.
+    """
+
+    backend: S3Cache = cache.cache
+    client = backend._s3_client
+    put_object = client.put_object
+
+    def put_object_without_conditions(**kwargs):
+        if "IfNoneMatch" in kwargs:
+            raise client.exceptions.ClientError(
+                {"Error": {"Code": "NotImplemented", "Message": "Not implemented"}},
+                "PutObject",
+            )
+        return put_object(**kwargs)
+
+    monkeypatch.setattr(client, "put_object", put_object_without_conditions)
+    monkeypatch.setitem(S3Cache._conditional_writes, backend._endpoint_url, True)
+
+    key = unique_key("hamlet_5_2")
+    expected_value = "The rest is silence."
+
+    assert cache.add(key, expected_value) is True
+    assert S3Cache._conditional_writes[backend._endpoint_url] is False
+
+    assert cache.add(key, "Goodnight, sweet prince") is False
+
+    assert_body_equals(
+        default_bucket.Object(key=f"{default_cache_prefix}{key}").get(),
+        expected_value.encode("utf-8"),
+    )
 
 
 def test_cache_set_with_explicit_expiration(
-    cache: Cache, default_bucket: S3Bucket, default_cache_prefix: str
+    cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
 ):
     """Set an item in the cache with an explicit expiration"""
 
+    key = unique_key("key")
     one_day = 60 * 60 * 24
-    now = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
-    )
 
-    with freeze_time(now):
-        result = cache.set("key", "something I'd like to cache", timeout=one_day)
-        assert result is True
+    pre = int(time.time())
+    result = cache.set(key, "something I'd like to cache", timeout=one_day)
+    post = int(time.time())
+    assert result is True
 
-    stored = default_bucket.Object(key=f"{default_cache_prefix}key").get()
-    expiration = datetime.datetime.fromtimestamp(
-        int(stored["Metadata"]["expires_at"]), tz=datetime.timezone.utc
-    )
+    stored = fetch_with_meta(default_bucket, f"{default_cache_prefix}{key}")
+    expires_at = int(stored.metadata["expires_at"])
 
-    assert now < expiration
-    assert expiration == (now + datetime.timedelta(seconds=one_day))
+    assert pre + one_day <= expires_at <= post + one_day
+    assert stored.expires == datetime.datetime.fromtimestamp(
+        expires_at, tz=datetime.timezone.utc
+    )
 
 
 def test_cache_set_with_explicit_forever_timeout(
-    cache: Cache, default_bucket: S3Bucket, default_cache_prefix: str
+    cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
 ):
     """Forever actually means 2000 days due to S3 requiring a valid datetime"""
 
-    now = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
-    )
-
-    with freeze_time(now):
-        result = cache.set("key", "something I'd like to cache", timeout=0)
-        assert result is True
+    key = unique_key("key")
+    result = cache.set(key, "something I'd like to cache", timeout=0)
+    assert result is True
 
-    stored = default_bucket.Object(key=f"{default_cache_prefix}key").get()
-    value = stored["Body"].read()
-    assert value.decode() == "something I'd like to cache"
+    stored = fetch_with_meta(default_bucket, f"{default_cache_prefix}{key}")
+    assert stored.body.decode() == "something I'd like to cache"
 
-    # No expires_at means never expires
-    assert "expires_at" not in stored["Metadata"]
+    # No expiration means never expires
+    assert "expires_at" not in stored.metadata
+    assert stored.expires is None
 
 
 def test_cache_add_with_explicit_expiration(
-    cache: Cache, default_bucket: S3Bucket, default_cache_prefix: str
+    cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
 ):
     """
     Add an item in the cache with an explicit expiration
@@ -264,21 +853,20 @@ def test_cache_add_with_explicit_expiration(
               overwrite existing keys/values.
     """
 
-    key = "hamlet_5_2"
+    key = unique_key("hamlet_5_2")
     expected_value = "The rest is silence."
 
     one_day = 60 * 60 * 24
-    now = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
-    )
 
-    with freeze_time(now):
-        result = cache.add(key, expected_value, timeout=one_day)
+    pre = int(time.time())
+    result = cache.add(key, expected_value, timeout=one_day)
+    post = int(time.time())
     assert result is True
 
-    stored = default_bucket.Object(key=f"{default_cache_prefix}{key}").get()
-    data = stored["Body"].read()
-    assert data.decode() == expected_value
+    assert_body_equals(
+        default_bucket.Object(key=f"{default_cache_prefix}{key}").get(),
+        expected_value.encode("utf-8"),
+    )
 
     # Now attempt to call cache.add() again with the same key, but
     # a different value
@@ -286,20 +874,22 @@ def test_cache_add_with_explicit_expiration(
     assert result is False
 
     # check that the original value hasn't been overwritten.
-    stored = default_bucket.Object(key=f"{default_cache_prefix}{key}").get()
-    expiration = datetime.datetime.fromtimestamp(
-        int(stored["Metadata"]["expires_at"]), tz=datetime.timezone.utc
-    )
-    data = stored["Body"].read()
+    stored = fetch_with_meta(default_bucket, f"{default_cache_prefix}{key}")
+    expires_at = int(stored.metadata["expires_at"])
 
-    assert data.decode() == expected_value
+    assert stored.body.decode() == expected_value
 
-    assert now < expiration
-    assert expiration == (now + datetime.timedelta(seconds=one_day))
+    assert pre + one_day <= expires_at <= post + one_day
+    assert stored.expires == datetime.datetime.fromtimestamp(
+        expires_at, tz=datetime.timezone.utc
+    )
 
 
 def test_cache_add_with_explicit_forever_timeout(
-    cache: Cache, default_bucket: S3Bucket, default_cache_prefix: str
+    cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
 ):
     """
     Add an item in the cache with a timeout of ``0`` which means that the
@@ -309,20 +899,16 @@ def test_cache_add_with_explicit_forever_timeout(
               overwrite existing keys/values.
     """
 
-    key = "hamlet_5_2"
+    key = unique_key("hamlet_5_2")
     expected_value = "The rest is silence."
 
-    now = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
-    )
-
-    with freeze_time(now):
-        result = cache.add(key, expected_value, timeout=0)
+    result = cache.add(key, expected_value, timeout=0)
     assert result is True
 
-    stored = default_bucket.Object(key=f"{default_cache_prefix}{key}").get()
-    data = stored["Body"].read()
-    assert data.decode() == expected_value
+    assert_body_equals(
+        default_bucket.Object(key=f"{default_cache_prefix}{key}").get(),
+        expected_value.encode("utf-8"),
+    )
 
     # Now attempt to call cache.add() again with the same key, but
     # a different value
@@ -330,87 +916,72 @@ def test_cache_add_with_explicit_forever_timeout(
     assert result is False
 
     # check that the original value hasn't been overwritten.
-    stored = default_bucket.Object(key=f"{default_cache_prefix}{key}").get()
-    data = stored["Body"].read()
-
-    assert data.decode() == expected_value
-    assert "expires_at" not in stored["Metadata"]
-
-
-def test_cache_delete_single_item(
-    cache: Cache,
-    default_bucket: S3Bucket,
-    cache_item: CachedItemMaker,
-    s3: S3ServiceResource,
-):
-    """Remove an item from the cache that has not expired."""
-
-    key = "polonius_2_2"
-    value = "Brevity is the soul of wit."
-    now = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
-    )
-    object = cache_item(
-        default_bucket, key, value, expires_at=(now + datetime.timedelta(seconds=300))
-    )
-
-    result = cache.delete(key)
-    assert result is True
-
-    with pytest.raises(s3.meta.client.exceptions.NoSuchKey):
-        object.get()
-
-
-def test_cache_delete_expired_item(
+    stored = fetch_with_meta(default_bucket, f"{default_cache_prefix}{key}")
+
+    assert stored.body.decode() == expected_value
+    assert "expires_at" not in stored.metadata
+    assert stored.expires is None
+
+
+@pytest.mark.parametrize(
+    "expiry_delta, preexisting",
+    [
+        (datetime.timedelta(seconds=300), True),
+        (datetime.timedelta(days=-1), True),
+        (None, False),
+    ],
+    ids=["fresh", "expired", "missing"],
+)
+def test_cache_delete(
     cache: Cache,
     default_bucket: S3Bucket,
+    default_cache_prefix: str,
     cache_item: CachedItemMaker,
     s3: S3ServiceResource,
+    now_utc: datetime.datetime,
+    unique_key: t.Callable[[str], str],
+    expiry_delta: t.Optional[datetime.timedelta],
+    preexisting: bool,
 ):
-    """Remove an item from the cache that has already expired."""
-
-    key = "polonius_2_2"
-    value = "Brevity is the soul of wit."
-    yesterday = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
-    ) - datetime.timedelta(days=1)
-    object = cache_item(default_bucket, key, value, expires_at=yesterday)
-
-    result = cache.delete(key)
-    assert result is True
-
-    with pytest.raises(s3.meta.client.exceptions.NoSuchKey):
-        object.get()
-
-
-def test_cache_delete_single_item_not_in_cache(cache: Cache, default_bucket: S3Bucket):
     """
-    Attempt to remove an item from the cache that does not exist.
+    Remove an item from the cache, whether it has expired or not.
 
     Note: S3 semantics mean that deleting a key that does not exist will not have
     a response that materially differs from deleting a key that does exist, so we
     return success in all cases unless there is an underlying error in the operation.
     """
 
-    key = "fake_item"
+    key = unique_key("polonius_2_2")
+    if preexisting:
+        cache_item(
+            key,
+            "Brevity is the soul of wit.",
+            expires_at=(now_utc + expiry_delta),
+        )
+
     result = cache.delete(key)
     assert result is True
 
+    with pytest.raises(s3.meta.client.exceptions.NoSuchKey):
+        default_bucket.Object(key=f"{default_cache_prefix}{key}").get()
+
 
 def test_cache_delete_multiple_items(
     cache: Cache,
     default_bucket: S3Bucket,
-    cache_item: CachedItemMaker,
+    default_cache_prefix: str,
     s3: S3ServiceResource,
+    unique_key: t.Callable[[str], str],
 ):
     """Remove multiple items from the cache."""
 
-    data = [("one", "existing value 1"), ("two", "existing value 2")]
-    objects = []
-    for item in data:
-        objects.append(cache_item(default_bucket, item[0], item[1]))
+    data = {
+        unique_key("one"): "existing value 1",
+        unique_key("two"): "existing value 2",
+    }
+    objects = bulk_cache_items(default_bucket, data, default_cache_prefix)
 
-    result = cache.delete_many("one", "two")
+    result = cache.delete_many(*data)
     assert result is True
 
     # Each item will raise NoSuchKey exception because they have been
@@ -420,110 +991,173 @@ def test_cache_delete_multiple_items(
             obj.get()
 
 
-def test_cache_has_item_that_expired(
+def test_cache_delete_many_items_beyond_batch_size(
     cache: Cache,
     default_bucket: S3Bucket,
-    cache_item: CachedItemMaker,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
 ):
     """
-    If an item is expired, the check will return False.
+    Remove more items than S3 accepts in a single ``DeleteObjects`` request.
     """
 
-    key = "polonius_2_2"
-    value = "Brevity is the soul of wit."
-    yesterday = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
-    ) - datetime.timedelta(days=1)
-
-    # Put object and set expieration to yesterday
-    object = cache_item(default_bucket, key, value, expires_at=yesterday)
+    keys = [unique_key(f"item_{i}") for i in range(DELETE_BATCH_SIZE + 1)]
+    bulk_cache_items(default_bucket, dict.fromkeys(keys, ""), default_cache_prefix)
 
-    result = cache.has(key)
-    assert result is False
+    result = cache.delete_many(*keys)
+    assert result is True
 
-    # Reading the expired item should _not_ purge it by default, and it should
-    # still be in S3
-    assert object.get()["Body"].read().decode() == value
+    assert not list(default_bucket.objects.filter(Prefix=default_cache_prefix))
 
 
-def test_cache_has_item_that_expired_purge(
-    purging_cache: Cache,
-    default_bucket: S3Bucket,
+@pytest.mark.parametrize(
+    "cache_fixture, purged",
+    [("cache", False), ("purging_cache", True)],
+)
+def test_cache_has_item_that_expired(
+    request: pytest.FixtureRequest,
     cache_item: CachedItemMaker,
     s3: S3ServiceResource,
+    now_utc: datetime.datetime,
+    unique_key: t.Callable[[str], str],
+    cache_fixture: str,
+    purged: bool,
 ):
     """
-    If an item is expired when we perform cache.has(key), and the cache
-    is configured to purge expired items, remove the item.
+    If an item is expired, the check will return False.
+
+    The item is only removed from S3 if the cache is configured to purge
+    expired items.
     """
 
-    key = "polonius_2_2"
+    cache: Cache = request.getfixturevalue(cache_fixture)
+
+    key = unique_key("polonius_2_2")
     value = "Brevity is the soul of wit."
-    yesterday = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
-    ) - datetime.timedelta(days=1)
+    yesterday = now_utc - datetime.timedelta(days=1)
 
-    object = cache_item(default_bucket, key, value, expires_at=yesterday)
+    # Put object and set expiration to yesterday
+    object = cache_item(key, value, expires_at=yesterday)
 
-    result = purging_cache.has(key)
+    result = cache.has(key)
     assert result is False
 
-    # Item should no longer exist in S3 after being purged
-    with pytest.raises(s3.meta.client.exceptions.NoSuchKey):
-        object.get()
+    if purged:
+        with pytest.raises(s3.meta.client.exceptions.NoSuchKey):
+            object.get()
+    else:
+        assert_body_equals(object.get(), value.encode("utf-8"))
 
 
 def test_cache_has_item_not_expired(
     cache: Cache,
-    default_bucket: S3Bucket,
     cache_item: CachedItemMaker,
+    now_utc: datetime.datetime,
+    unique_key: t.Callable[[str], str],
 ):
     """
     Check that an item exists in the cache, and that item has not expired yet.
     """
 
-    key = "polonius_2_2"
+    key = unique_key("polonius_2_2")
     value = "Brevity is the soul of wit."
-    tomorrow = datetime.datetime.utcnow().replace(
-        tzinfo=datetime.timezone.utc, microsecond=0
-    ) + datetime.timedelta(days=1)
+    tomorrow = now_utc + datetime.timedelta(days=1)
 
     # Put object and set expieration to yesterday
-    cache_item(default_bucket, key, value, expires_at=tomorrow)
+    cache_item(key, value, expires_at=tomorrow)
 
     result = cache.has(key)
     assert result is True
 
 
+def test_cache_has_item_with_metadata_cache(
+    metadata_caching_cache: Cache,
+    cache_item: CachedItemMaker,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    Repeated existence checks are answered from the in-process metadata cache,
+    until the item is changed through the cache itself.
+    """
+
+    key = unique_key("polonius_2_2")
+    value = "Brevity is the soul of wit."
+    object = cache_item(key, value)
+
+    assert metadata_caching_cache.has(key) is True
+
+    # Removing the item behind the cache's back goes unnoticed...
+    object.delete()
+    assert metadata_caching_cache.has(key) is True
+
+    # ...but removing it through the cache does not.
+    metadata_caching_cache.delete(key)
+    assert metadata_caching_cache.has(key) is False
+
+
+def test_sharded_cache(
+    sharded_cache: Cache,
+    default_bucket: S3Bucket,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
+):
+    """
+    Keys are stored under a shard between the cache prefix and the key, which
+    is transparent to users of the cache.
+    """
+
+    key = unique_key("hamlet_5_2")
+    value = "The rest is silence."
+
+    assert sharded_cache.set(key, value) is True
+
+    (stored,) = default_bucket.objects.filter(Prefix=default_cache_prefix)
+    shard, _, stored_key = stored.key[len(default_cache_prefix) :].partition("/")
+    assert len(shard) == 1
+    assert stored_key == key
+
+    assert sharded_cache.get(key) == value
+    assert sharded_cache.has(key) is True
+
+    assert sharded_cache.delete(key) is True
+    assert sharded_cache.has(key) is False
+
+
 def test_cache_clear(
     cache: Cache,
     default_bucket: S3Bucket,
     s3: S3ServiceResource,
-    cache_item: CachedItemMaker,
+    default_cache_prefix: str,
+    unique_key: t.Callable[[str], str],
 ):
     """Clear out all items from the cache that have the configured cache prefix."""
 
     # put several items into the cache so that we can clear them out
-    data = [("one", "existing value 1"), ("two", "existing value 2")]
-    objects = []
-    for item in data:
-        objects.append(cache_item(default_bucket, item[0], item[1]))
+    data = {
+        unique_key("one"): "existing value 1",
+        unique_key("two"): "existing value 2",
+    }
+    bulk_cache_items(default_bucket, data, default_cache_prefix)
 
     # put an item that doesn't have the common prefix to ensure that we don't
     # mistakenly delete it
-    prefixless_key = "whodis"
+    prefixless_key = unique_key("whodis")
     prefixless_value = "call me maybe"
 
     prefixless_object = default_bucket.Object(key=f"{prefixless_key}")
-    prefixless_object.put(Body=io.BytesIO(bytes(prefixless_value, "utf-8")))
+    prefixless_object.put(Body=prefixless_value.encode("utf-8"))
 
     result = cache.clear()
     assert result is True
 
     # Ensure prefixed data was cleared
-    for obj in objects:
-        with pytest.raises(s3.meta.client.exceptions.NoSuchKey):
-            obj.get()
+    listing = s3.meta.client.list_objects_v2(
+        Bucket=default_bucket.name, Prefix=default_cache_prefix
+    )
+    assert listing.get("Contents", []) == []
 
     # Make sure we didn't clear out unprefixed data
-    assert prefixless_object.get()["Body"].read().decode() == prefixless_value
+    assert_body_equals(prefixless_object.get(), prefixless_value.encode("utf-8"))
+
+    # It lives outside the cache prefix, so it's ours to clean up
+    prefixless_object.delete()
@@ -0,0 +1,124 @@
+"""
+Unit tests for the in-process metadata cache of the S3Cache backend
+
+These don't talk to S3 at all.
+"""
+
+from __future__ import annotations
+import time
+
+import pytest
+
+from flask_caching_s3 import _MetadataCache
+
+
+class FakeClock:
+    """Stand-in for ``time.monotonic`` that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    """Freeze ``time.monotonic``, as seen by the metadata cache"""
+
+    fake = FakeClock()
+    monkeypatch.setattr(time, "monotonic", fake)
+    return fake
+
+
+def test_metadata_cache_entry_expires_after_ttl(clock: FakeClock):
+    """
+    An entry for an existing item is trusted for ``ttl`` seconds, and no longer.
+    """
+
+    metadata = _MetadataCache(maxsize=10, ttl=5, negative_ttl=1)
+    metadata.set("key", True, 1234)
+
+    clock.advance(5)
+    assert metadata.get("key") == (True, 1234)
+
+    clock.advance(0.1)
+    assert metadata.get("key") is None
+
+
+def test_metadata_cache_missing_entry_expires_after_negative_ttl(clock: FakeClock):
+    """
+    An entry for a missing item is only trusted for ``negative_ttl`` seconds.
+    """
+
+    metadata = _MetadataCache(maxsize=10, ttl=5, negative_ttl=1)
+    metadata.set("key", False)
+
+    clock.advance(1)
+    assert metadata.get("key") == (False, None)
+
+    clock.advance(0.1)
+    assert metadata.get("key") is None
+
+
+def test_metadata_cache_set_resets_ttl(clock: FakeClock):
+    """
+    Setting an entry again restarts its TTL, which depends on whether the
+    item exists.
+    """
+
+    metadata = _MetadataCache(maxsize=10, ttl=5, negative_ttl=1)
+    metadata.set("key", False)
+
+    clock.advance(0.5)
+    metadata.set("key", True)
+
+    clock.advance(4)
+    assert metadata.get("key") == (True, None)
+
+
+def test_metadata_cache_evicts_least_recently_used(clock: FakeClock):
+    """
+    Beyond ``maxsize`` entries, the least recently used one is evicted, where
+    reading an entry counts as using it.
+    """
+
+    metadata = _MetadataCache(maxsize=3, ttl=5, negative_ttl=1)
+    metadata.set("a", True)
+    metadata.set("b", True)
+    metadata.set("c", True)
+
+    # "a" becomes the most recently used, leaving "b" as the least
+    assert metadata.get("a") == (True, None)
+    metadata.set("d", True)
+
+    assert metadata.get("b") is None
+    assert metadata.get("a") == (True, None)
+    assert metadata.get("c") == (True, None)
+    assert metadata.get("d") == (True, None)
+
+    # Now "a" is the least recently used
+    metadata.set("e", True)
+    assert metadata.get("a") is None
+
+
+def test_metadata_cache_discard_and_clear(clock: FakeClock):
+    """
+    Discarded entries, and all entries after a clear, are forgotten.
+    """
+
+    metadata = _MetadataCache(maxsize=10, ttl=5, negative_ttl=1)
+    metadata.set("a", True)
+    metadata.set("b", False)
+    metadata.set("c", True)
+
+    metadata.discard("a", "b", "unknown")
+    assert metadata.get("a") is None
+    assert metadata.get("b") is None
+    assert metadata.get("c") == (True, None)
+
+    metadata.clear()
+    assert metadata.get("c") is None